@@ -41,25 +41,305 @@
 """
 
 import asyncio
-import json
+import hashlib
 import logging
 import os
 import time
+from collections import OrderedDict
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Any
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
 from dataclasses import dataclass, asdict
 from enum import Enum
-import requests
-from openai import OpenAI
-import anthropic
-import google.generativeai as genai
+import httpx
+import orjson
+from tenacity import AsyncRetrying, retry_if_exception_type, stop_after_attempt, wait_exponential_jitter
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
+# httpx logs every request at INFO, which would swamp the trip log
+logging.getLogger("httpx").setLevel(logging.WARNING)
 logger = logging.getLogger(__name__)
 
+# Model used for each LLM task: lightweight models for retrieval-style
+# lookups, stronger ones where the task needs reasoning
+MODEL_TIER = {
+    'research': 'gpt-4o',
+    'weather': 'gpt-4o-mini',
+    'events': 'gpt-4o-mini',
+    'attractions': 'gpt-4o',
+    'accommodation': 'gpt-4o-mini',
+    'transport': 'gpt-4o-mini',
+    'synthesis': 'gpt-4o',
+    'itinerary': 'claude-3-sonnet-20240229',
+    'logistics': 'claude-3-haiku-20240307',
+    'costs': 'claude-3-haiku-20240307'
+}
+
+def _prompt_json(data: Any) -> str:
+    """Serialize data for embedding in a prompt without token-wasting whitespace"""
+    return orjson.dumps(data).decode()
+
+# Prompt templates, filled in with str.format by the agents
+_COMBINED_RESEARCH_PROMPT = """\
+Research {destination} for a {constraints.duration_days}-day trip by {constraints.traveler_count} travelers
+with {constraints.travel_style} style and an accommodation budget of ${budget_per_night:.0f} per night.
+
+Return a JSON object with exactly these keys:
+"""
+
+# One key description per research section, appended to the combined prompt
+_COMBINED_RESEARCH_SECTIONS = {
+    'weather': """\
+- "weather": current season and typical weather patterns, temperature ranges, precipitation likelihood,
+  best times to visit outdoor attractions and seasonal considerations for the next {constraints.duration_days} days
+""",
+    'events': """\
+- "events": cultural festivals, local markets, seasonal activities, special exhibitions or shows and
+  food festivals or wine harvests in the next 30 days, with specific dates when possible
+""",
+    'attractions': """\
+- "attractions": array of the top 15-20 attractions, each with name, brief description, approximate
+  coordinates (lat, lng), category, typical visit duration, entry cost and best time to visit
+""",
+    'accommodation': """\
+- "accommodation": hotels in different price ranges, guesthouses or B&Bs and unique local options,
+  with pricing, locations and booking considerations
+""",
+    'transport': """\
+- "transport": airport transfers, public transportation, car rental options and costs, inter-city transport,
+  walking distances between attractions and local transport apps or services
+"""
+}
+
+_WEATHER_PROMPT = """\
+Provide current weather information and forecast for {destination} for the next {duration} days.
+Include:
+- Current season and typical weather patterns
+- Temperature ranges
+- Precipitation likelihood
+- Best times to visit outdoor attractions
+- Seasonal considerations for activities
+
+Format as structured data.
+"""
+
+_EVENTS_PROMPT = """\
+Research current events, festivals, and seasonal activities in {destination}.
+Focus on events happening in the next 30 days.
+Include:
+- Cultural festivals
+- Local markets
+- Seasonal activities
+- Special exhibitions or shows
+- Food festivals or wine harvests
+
+Provide specific dates when possible.
+"""
+
+_EVENT_LISTINGS_PROMPT = """\
+
+Use these current event listings where relevant:
+{listings}
+"""
+
+_ATTRACTIONS_PROMPT = """\
+List the top 15-20 attractions and points of interest in {destination}.
+For each attraction, provide:
+- Name
+- Brief description
+- Approximate coordinates (lat, lng)
+- Category (historical, natural, cultural, etc.)
+- Typical visit duration
+- Entry cost (if any)
+- Best time to visit
+
+Format as JSON array.
+"""
+
+_ACCOMMODATION_PROMPT = """\
+Research accommodation options in {destination} for {constraints.traveler_count} travelers.
+Budget: ${budget_per_night:.0f} per night
+Duration: {constraints.duration_days} days
+Style: {constraints.travel_style}
+
+Provide recommendations for:
+- Hotels in different price ranges
+- Guesthouses or B&Bs
+- Unique local accommodation options
+
+Include pricing, locations, and booking considerations.
+"""
+
+_TRANSPORT_PROMPT = """\
+Research transportation options in and around {destination} for {constraints.duration_days} days.
+Consider:
+- Airport transfers
+- Public transportation
+- Car rental options and costs
+- Inter-city transport
+- Walking distances between attractions
+- Local transport apps or services
+
+Provide practical advice for {constraints.traveler_count} travelers with {constraints.travel_style} style.
+"""
+
+_SYNTHESIS_PROMPT = """\
+Synthesize the following travel research data for {destination}:
+
+Weather: {weather}
+Events: {events}
+Attractions: {attractions}
+Accommodation: {accommodation}
+Transport: {transport}
+
+Constraints: {constraints}
+
+Provide a structured summary including:
+1. Best areas to stay
+2. Must-see attractions with priorities
+3. Optimal transportation strategy
+4. Seasonal considerations
+5. Budget allocation recommendations
+6. Potential challenges or considerations
+7. Daily activity suggestions
+
+Format as structured JSON.
+"""
+
+_ITINERARY_PROMPT = """\
+Create an optimized {constraints.duration_days}-day itinerary for {destination} based on this research data:
+
+{research_data}
+
+Constraints:
+- Total budget: ${constraints.total_budget_usd}
+- Travelers: {constraints.traveler_count}
+- Style: {constraints.travel_style}
+- Preferences: {preferences}
+
+Create a day-by-day itinerary that:
+1. Optimizes travel time between locations
+2. Groups activities by geographic proximity
+3. Balances indoor/outdoor activities based on weather
+4. Fits within budget constraints
+5. Includes specific timing for activities
+6. Suggests accommodation locations
+7. Plans transportation between cities/regions
+
+Format as structured JSON with this schema:
+{{
+    "itinerary": [
+        {{
+            "day": 1,
+            "date": "2024-XX-XX",
+            "location": "City/Area Name",
+            "activities": [
+                {{
+                    "time": "09:00",
+                    "activity": "Activity Name",
+                    "duration": "2 hours",
+                    "cost": 25.00,
+                    "description": "Brief description",
+                    "location": "Specific location"
+                }}
+            ],
+            "accommodation": "Hotel/Area recommendation",
+            "transportation": "How to get around",
+            "daily_budget": 150.00,
+            "notes": "Special considerations"
+        }}
+    ]
+}}
+"""
+
+_LOGISTICS_PROMPT = """\
+Optimize the logistics of this itinerary:
+
+{itinerary}
+
+Focus on:
+1. Minimizing travel time between activities
+2. Optimizing daily schedules (avoid rushing, allow buffer time)
+3. Grouping activities by location
+4. Considering opening hours and booking requirements
+5. Planning meal times and breaks
+6. Accounting for transportation delays
+
+Return the optimized itinerary with the same JSON structure but improved timing and logistics.
+"""
+
+_LOGISTICS_CONTEXT_PROMPT = """
+Take this weather, events and transport research into account:
+
+{context}
+"""
+
+_COSTS_PROMPT = """\
+Analyze the costs for this itinerary:
+
+{itinerary}
+
+Budget: ${constraints.total_budget_usd}
+Travelers: {constraints.traveler_count}
+
+Provide detailed cost breakdown:
+1. Daily costs by category (accommodation, food, activities, transport)
+2. Total estimated cost
+3. Budget vs actual comparison
+4. Cost optimization suggestions if over budget
+5. Buffer recommendations
+
+Format as JSON with specific cost figures.
+"""
+
+_PERSONALIZATION_PROMPT = """\
+Personalize this travel itinerary based on user preferences:
+
+ITINERARY:
+{itinerary}
+
+USER PROFILE:
+- Preferences: {preferences}
+- Travel style: {constraints.travel_style}
+- Group size: {constraints.traveler_count}
+- Must visit: {must_visit}
+- Avoid: {avoid}
+
+RESEARCH CONTEXT:
+{research_data}
+
+Personalize by:
+1. Replacing generic recommendations with specific ones matching preferences
+2. Adjusting activity types and intensity based on travel style
+3. Adding local experiences that match interests
+4. Suggesting restaurants and food experiences
+5. Including shopping or cultural activities if relevant
+6. Adding photography spots if interested in photography
+7. Suggesting local interactions or cultural immersion opportunities
+
+Keep the same JSON structure but enhance with personalized details.
+"""
+
+_RECOMMENDATIONS_PROMPT = """\
+Enhance this personalized itinerary with contextual recommendations:
+
+{itinerary}
+
+Add:
+1. Local etiquette and cultural tips
+2. Language phrases that might be helpful
+3. Tipping customs and payment methods
+4. Safety considerations
+5. Packing suggestions specific to activities
+6. Alternative options for bad weather
+7. Local apps or services to download
+8. Emergency contacts and important information
+
+Format as enhanced JSON with additional context fields.
+"""
+
 # Data Models
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Location:
     name: str
     latitude: float
@@ -68,7 +348,7 @@ class Location:
     description: str = ""
     cost_level: int = 1  # 1-5 scale
 
-@dataclass
+@dataclass(slots=True)
 class Activity:
     name: str
     location: Location
@@ -79,17 +359,24 @@ class Activity:
     booking_required: bool = False
     seasonal_info: str = ""
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class TravelConstraints:
     total_budget_usd: float
     duration_days: int
     traveler_count: int
-    preferences: List[str]
-    must_visit: List[str] = None
-    avoid: List[str] = None
+    preferences: Tuple[str, ...]
+    must_visit: Optional[Tuple[str, ...]] = None
+    avoid: Optional[Tuple[str, ...]] = None
     travel_style: str = "balanced"  # budget, balanced, luxury
 
-@dataclass
+    def __post_init__(self):
+        # Store sequences as tuples so frozen constraints stay hashable
+        for name in ('preferences', 'must_visit', 'avoid'):
+            value = getattr(self, name)
+            if value is not None:
+                object.__setattr__(self, name, tuple(value))
+
+@dataclass(slots=True)
 class ItineraryDay:
     day: int
     date: str
@@ -99,7 +386,7 @@ class ItineraryDay:
     transportation: Optional[Dict] = None
     estimated_cost: float = 0.0
 
-@dataclass
+@dataclass(slots=True)
 class CompleteItinerary:
     destination_country: str
     total_days: int
@@ -115,250 +402,400 @@ class AgentType(Enum):
 
 # Base Agent Class
 class BaseAgent:
+    CACHE_SIZE = 128  # completions kept per agent, least recently used evicted first
+    MAX_CONCURRENT_REQUESTS = 10  # stay under provider rate limits
+    MAX_ATTEMPTS = 5
+    
+    # Transient provider errors worth retrying; set by each agent once its SDK is loaded
+    retryable_errors: tuple = ()
+
     def __init__(self, agent_type: AgentType, api_key: str):
         self.agent_type = agent_type
+        self._type_str = agent_type.value
         self.api_key = api_key
         self.processing_time = 0.0
+        self._cache: "OrderedDict[str, str]" = OrderedDict()
+        self._semaphore = asyncio.Semaphore(self.MAX_CONCURRENT_REQUESTS)
         
+    async def aclose(self) -> None:
+        """Release any connections the agent opened itself"""
+    
     async def process(self, input_data: Dict) -> Dict:
-        start_time = time.time()
+        start_time = time.perf_counter()
         result = await self._process_internal(input_data)
-        self.processing_time = time.time() - start_time
-        logger.info(f"{self.agent_type.value} agent completed in {self.processing_time:.2f}s")
+        self.processing_time = time.perf_counter() - start_time
+        logger.info("%s agent completed in %.2fs", self._type_str, self.processing_time)
         return result
     
     async def _process_internal(self, input_data: Dict) -> Dict:
         raise NotImplementedError
+    
+    def _stream(self, model: str, prompt: str, temperature: Optional[float], **options) -> AsyncIterator[str]:
+        """Send a single prompt to the provider and yield the response text as it is generated"""
+        raise NotImplementedError
+    
+    async def _complete(self, model: str, prompt: str, temperature: Optional[float], **options) -> str:
+        """Send a single prompt to the provider and return the full response text"""
+        return ''.join([text async for text in self._stream(model, prompt, temperature, **options)])
+    
+    async def _cached_complete(self, model: str, prompt: str, temperature: Optional[float] = None, **options) -> str:
+        """Return the completion for a prompt, reusing the response to an identical earlier request"""
+        key = self._cache_key(model, prompt, temperature, options)
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+        
+        text = await self._request(model, prompt, temperature, **options)
+        self._cache[key] = text
+        if len(self._cache) > self.CACHE_SIZE:
+            self._cache.popitem(last=False)
+        return text
+    
+    async def _request(self, model: str, prompt: str, temperature: Optional[float], **options) -> str:
+        """Call the provider under the concurrency cap, retrying transient failures with backoff"""
+        async for attempt in AsyncRetrying(
+            wait=wait_exponential_jitter(initial=1, max=30),
+            stop=stop_after_attempt(self.MAX_ATTEMPTS),
+            retry=retry_if_exception_type(self.retryable_errors),
+            before_sleep=self._log_retry,
+            reraise=True
+        ):
+            with attempt:
+                async with self._semaphore:
+                    return await self._complete(model, prompt, temperature, **options)
+    
+    def _log_retry(self, retry_state) -> None:
+        logger.warning(
+            "%s agent request failed on attempt %d/%d, retrying in %.1fs: %s",
+            self._type_str, retry_state.attempt_number, self.MAX_ATTEMPTS,
+            retry_state.next_action.sleep, retry_state.outcome.exception()
+        )
+    
+    @staticmethod
+    def _cache_key(model: str, prompt: str, temperature: Optional[float], options: Dict) -> str:
+        if temperature is not None:
+            temperature = round(temperature, 2)
+        payload = repr((model, prompt, temperature, sorted(options.items())))
+        return hashlib.blake2b(payload.encode(), digest_size=16).hexdigest()
 
 # Research Agent Implementation
 class ResearchAgent(BaseAgent):
-    def __init__(self, openai_api_key: str, serp_api_key: str = None):
+    # Research sections, each mapped to the key its lookup stores the result under
+    SECTIONS = {
+        'weather': 'weather_summary',
+        'events': 'events',
+        'attractions': 'attractions',
+        'accommodation': 'accommodation',
+        'transport': 'transport'
+    }
+    SYNTHESIS_CHAR_BUDGET = 24000  # ~6k tokens of raw research before it is synthesized
+    SERP_API_URL = "https://serpapi.com/search.json"
+
+    def __init__(self, openai_api_key: str, serp_api_key: str = None,
+                 http_client: Optional[httpx.AsyncClient] = None):
         super().__init__(AgentType.RESEARCH, openai_api_key)
-        self.client = OpenAI(api_key=openai_api_key)
+        # Provider SDKs are imported on first use to keep CLI and test start-up fast
+        import openai
+        self.retryable_errors = (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError)
+        # Provider and data-source requests share one keep-alive pool; a
+        # standalone agent opens its own and closes it in aclose
+        self._owns_http = http_client is None
+        self._http = httpx.AsyncClient() if self._owns_http else http_client
+        # Retries are handled by BaseAgent so they respect the concurrency cap
+        self.client = openai.AsyncOpenAI(api_key=openai_api_key, http_client=self._http, max_retries=0)
         self.serp_api_key = serp_api_key
+    
+    async def _stream(self, model: str, prompt: str, temperature: Optional[float], **options) -> AsyncIterator[str]:
+        stream = await self.client.chat.completions.create(
+            model=model,
+            messages=[{"role": "user", "content": prompt}],
+            temperature=temperature,
+            stream=True,
+            **options
+        )
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    
+    async def aclose(self) -> None:
+        """Close the HTTP pool if this agent opened it"""
+        if self._owns_http:
+            await self._http.aclose()
         
     async def _process_internal(self, input_data: Dict) -> Dict:
         destination = input_data['destination']
-        constraints = TravelConstraints(**input_data['constraints'])
-        
-        # Gather information from multiple sources
-        weather_info = await self._get_weather_info(destination, constraints.duration_days)
-        local_events = await self._get_local_events(destination)
-        attractions = await self._get_attractions(destination)
-        accommodation_info = await self._get_accommodation_info(destination, constraints)
-        transport_info = await self._get_transport_info(destination, constraints)
-        
-        # Synthesize information using GPT-4
-        research_summary = await self._synthesize_information({
-            'destination': destination,
-            'weather': weather_info,
-            'events': local_events,
-            'attractions': attractions,
-            'accommodation': accommodation_info,
-            'transport': transport_info,
-            'constraints': asdict(constraints)
-        })
+        constraints = input_data['constraints']
+        # Optional futures to resolve with each section as soon as it is known
+        published = input_data.get('sections')
+        # Event listings come from a third-party API, so fetch them while the
+        # lookups that do not use them are already running
+        listings = asyncio.create_task(self._search_events(destination))
+        try:
+            raw_data = await self._gather_research(destination, constraints, listings, published)
+        finally:
+            listings.cancel()
+        
+        # The Planning Agent reads the raw research directly; only condense it
+        # with GPT-4 when it is too large to pass through
+        if len(_prompt_json(raw_data)) > self.SYNTHESIS_CHAR_BUDGET:
+            research_summary = await self._synthesize_information({
+                'destination': destination,
+                **raw_data,
+                'constraints': asdict(constraints)
+            })
+        else:
+            research_summary = raw_data
         
         return {
             'destination': destination,
             'research_data': research_summary,
-            'raw_data': {
-                'weather': weather_info,
-                'events': local_events,
-                'attractions': attractions,
-                'accommodation': accommodation_info,
-                'transport': transport_info
-            },
+            'raw_data': raw_data,
             'processing_time': self.processing_time
         }
     
+    async def _gather_research(self, destination: str, constraints: TravelConstraints, listings: asyncio.Task,
+                               published: Optional[Dict[str, asyncio.Future]]) -> Dict[str, Dict]:
+        """Research every section, in one structured call where possible"""
+        # Events wait for the SerpAPI listings, so they are looked up on their own
+        # alongside the combined call rather than holding it up
+        separate = ('events',) if self.serp_api_key else ()
+        combined = tuple(name for name in self.SECTIONS if name not in separate)
+        
+        raw_data, separate_data = await asyncio.gather(
+            self._get_published_research(destination, constraints, listings, combined, published),
+            self._get_individual_research(destination, constraints, listings, separate, published)
+        )
+        raw_data.update(separate_data)
+        return {name: raw_data[name] for name in self.SECTIONS}
+    
+    async def _get_published_research(self, destination: str, constraints: TravelConstraints, listings: asyncio.Task,
+                                      sections: Tuple[str, ...],
+                                      published: Optional[Dict[str, asyncio.Future]]) -> Dict[str, Dict]:
+        """Research sections in one structured call and publish them without waiting on the separate lookups"""
+        # Fall back to the individual lookups if the combined call fails or comes back incomplete
+        raw_data = await self._get_combined_research(destination, constraints, sections)
+        if raw_data is None:
+            return await self._get_individual_research(destination, constraints, listings, sections, published)
+        for name, section in raw_data.items():
+            self._publish(published, name, section)
+        return raw_data
+    
+    async def _get_combined_research(self, destination: str, constraints: TravelConstraints,
+                                     sections: Tuple[str, ...]) -> Optional[Dict[str, Dict]]:
+        """Research the given sections with a single JSON-mode request"""
+        budget_per_night = constraints.total_budget_usd * 0.3 / constraints.duration_days  # 30% of budget for accommodation
+        
+        template = _COMBINED_RESEARCH_PROMPT + ''.join(_COMBINED_RESEARCH_SECTIONS[name] for name in sections)
+        prompt = template.format(
+            destination=destination, constraints=constraints, budget_per_night=budget_per_night
+        )
+        
+        try:
+            text = await self._cached_complete(
+                MODEL_TIER['research'], prompt, temperature=0.1, response_format={"type": "json_object"}
+            )
+            data = orjson.loads(text)
+            return {name: {self.SECTIONS[name]: data[name]} for name in sections}
+        except Exception as e:
+            logger.warning("Combined research failed, falling back to individual lookups: %s", e)
+            return None
+    
+    async def _get_individual_research(self, destination: str, constraints: TravelConstraints,
+                                       listings: asyncio.Task, sections: Tuple[str, ...],
+                                       published: Optional[Dict[str, asyncio.Future]] = None) -> Dict[str, Dict]:
+        """Run the given research lookups concurrently, publishing each one as it completes"""
+        lookups = {
+            'weather': lambda: self._get_weather_info(destination, constraints.duration_days),
+            'events': lambda: self._get_listed_events(destination, listings),
+            'attractions': lambda: self._get_attractions(destination),
+            'accommodation': lambda: self._get_accommodation_info(destination, constraints),
+            'transport': lambda: self._get_transport_info(destination, constraints)
+        }
+        results = await asyncio.gather(
+            *(self._run_lookup(name, lookups[name](), published) for name in sections)
+        )
+        return dict(zip(sections, results))
+    
+    async def _run_lookup(self, name: str, lookup, published: Optional[Dict[str, asyncio.Future]]) -> Dict:
+        """Await one lookup, turning an escaped error into its fallback so the others keep running"""
+        try:
+            section = await lookup
+        except Exception as e:
+            logger.error("Research lookup '%s' failed: %s", name, e)
+            section = {self.SECTIONS[name]: f"{name.title()} information unavailable"}
+        self._publish(published, name, section)
+        return section
+    
+    @staticmethod
+    def _publish(published: Optional[Dict[str, asyncio.Future]], name: str, section: Dict) -> None:
+        if published is not None and not published[name].done():
+            published[name].set_result(section)
+    
     async def _get_weather_info(self, destination: str, duration: int) -> Dict:
         """Get weather information for the destination"""
         # Using OpenWeatherMap API (free tier)
         try:
-            prompt = f"""
-            Provide current weather information and forecast for {destination} for the next {duration} days.
-            Include:
-            - Current season and typical weather patterns
-            - Temperature ranges
-            - Precipitation likelihood
-            - Best times to visit outdoor attractions
-            - Seasonal considerations for activities
-            
-            Format as structured data.
-            """
+            prompt = _WEATHER_PROMPT.format(destination=destination, duration=duration)
             
-            response = self.client.chat.completions.create(
-                model="gpt-4",
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.1
-            )
+            text = await self._cached_complete(MODEL_TIER['weather'], prompt, temperature=0.1)
             
-            return {"weather_summary": response.choices[0].message.content}
+            return {"weather_summary": text}
         except Exception as e:
-            logger.error(f"Weather API error: {e}")
+            logger.error("Weather API error: %s", e)
             return {"weather_summary": "Weather information unavailable"}
     
-    async def _get_local_events(self, destination: str) -> Dict:
+    async def _get_local_events(self, destination: str, listings: Optional[List[Dict]] = None) -> Dict:
         """Get local events and festivals"""
-        prompt = f"""
-        Research current events, festivals, and seasonal activities in {destination}.
-        Focus on events happening in the next 30 days.
-        Include:
-        - Cultural festivals
-        - Local markets
-        - Seasonal activities
-        - Special exhibitions or shows
-        - Food festivals or wine harvests
-        
-        Provide specific dates when possible.
-        """
+        prompt = _EVENTS_PROMPT.format(destination=destination)
+        if listings:
+            prompt += _EVENT_LISTINGS_PROMPT.format(listings=_prompt_json(listings))
         
         try:
-            response = self.client.chat.completions.create(
-                model="gpt-4",
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.1
-            )
-            return {"events": response.choices[0].message.content}
+            text = await self._cached_complete(MODEL_TIER['events'], prompt, temperature=0.1)
+            return {"events": text}
         except Exception as e:
-            logger.error(f"Events research error: {e}")
+            logger.error("Events research error: %s", e)
             return {"events": "Events information unavailable"}
     
+    async def _get_listed_events(self, destination: str, listings: asyncio.Task) -> Dict:
+        """Get local events once the SerpAPI listings have arrived"""
+        return await self._get_local_events(destination, await listings)
+    
+    async def _search_events(self, destination: str) -> List[Dict]:
+        """Fetch upcoming event listings from SerpAPI's Google Events engine"""
+        if not self.serp_api_key:
+            return []
+        
+        try:
+            response = await self._http.get(
+                self.SERP_API_URL,
+                params={'engine': 'google_events', 'q': f"Events in {destination}", 'api_key': self.serp_api_key},
+                timeout=5
+            )
+            response.raise_for_status()
+            return [
+                {
+                    'title': event.get('title'),
+                    'when': event.get('date', {}).get('when'),
+                    'address': ', '.join(event.get('address', []))
+                }
+                for event in response.json().get('events_results', [])
+            ]
+        except httpx.HTTPStatusError as e:
+            # The request URL carries the API key, so never log the error text
+            logger.error("SerpAPI events error: HTTP %d", e.response.status_code)
+            return []
+        except Exception as e:
+            logger.error("SerpAPI events error: %s", type(e).__name__)
+            return []
+    
     async def _get_attractions(self, destination: str) -> List[Location]:
         """Get top attractions and points of interest"""
-        prompt = f"""
-        List the top 15-20 attractions and points of interest in {destination}.
-        For each attraction, provide:
-        - Name
-        - Brief description
-        - Approximate coordinates (lat, lng)
-        - Category (historical, natural, cultural, etc.)
-        - Typical visit duration
-        - Entry cost (if any)
-        - Best time to visit
-        
-        Format as JSON array.
-        """
+        prompt = _ATTRACTIONS_PROMPT.format(destination=destination)
         
         try:
-            response = self.client.chat.completions.create(
-                model="gpt-4",
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.1
-            )
-            return {"attractions": response.choices[0].message.content}
+            text = await self._cached_complete(MODEL_TIER['attractions'], prompt, temperature=0.1)
+            return {"attractions": text}
         except Exception as e:
-            logger.error(f"Attractions research error: {e}")
+            logger.error("Attractions research error: %s", e)
             return {"attractions": "Attractions information unavailable"}
     
     async def _get_accommodation_info(self, destination: str, constraints: TravelConstraints) -> Dict:
         """Research accommodation options"""
         budget_per_night = constraints.total_budget_usd * 0.3 / constraints.duration_days  # 30% of budget for accommodation
         
-        prompt = f"""
-        Research accommodation options in {destination} for {constraints.traveler_count} travelers.
-        Budget: ${budget_per_night:.0f} per night
-        Duration: {constraints.duration_days} days
-        Style: {constraints.travel_style}
-        
-        Provide recommendations for:
-        - Hotels in different price ranges
-        - Guesthouses or B&Bs
-        - Unique local accommodation options
-        
-        Include pricing, locations, and booking considerations.
-        """
+        prompt = _ACCOMMODATION_PROMPT.format(
+            destination=destination, constraints=constraints, budget_per_night=budget_per_night
+        )
         
         try:
-            response = self.client.chat.completions.create(
-                model="gpt-4",
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.1
-            )
-            return {"accommodation": response.choices[0].message.content}
+            text = await self._cached_complete(MODEL_TIER['accommodation'], prompt, temperature=0.1)
+            return {"accommodation": text}
         except Exception as e:
-            logger.error(f"Accommodation research error: {e}")
+            logger.error("Accommodation research error: %s", e)
             return {"accommodation": "Accommodation information unavailable"}
     
     async def _get_transport_info(self, destination: str, constraints: TravelConstraints) -> Dict:
         """Research transportation options"""
-        prompt = f"""
-        Research transportation options in and around {destination} for {constraints.duration_days} days.
-        Consider:
-        - Airport transfers
-        - Public transportation
-        - Car rental options and costs
-        - Inter-city transport
-        - Walking distances between attractions
-        - Local transport apps or services
-        
-        Provide practical advice for {constraints.traveler_count} travelers with {constraints.travel_style} style.
-        """
+        prompt = _TRANSPORT_PROMPT.format(destination=destination, constraints=constraints)
         
         try:
-            response = self.client.chat.completions.create(
-                model="gpt-4",
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.1
-            )
-            return {"transport": response.choices[0].message.content}
+            text = await self._cached_complete(MODEL_TIER['transport'], prompt, temperature=0.1)
+            return {"transport": text}
         except Exception as e:
-            logger.error(f"Transport research error: {e}")
+            logger.error("Transport research error: %s", e)
             return {"transport": "Transport information unavailable"}
     
     async def _synthesize_information(self, data: Dict) -> Dict:
         """Synthesize all research into structured format"""
-        prompt = f"""
-        Synthesize the following travel research data for {data['destination']}:
-        
-        Weather: {data['weather']}
-        Events: {data['events']}
-        Attractions: {data['attractions']}
-        Accommodation: {data['accommodation']}
-        Transport: {data['transport']}
-        
-        Constraints: {data['constraints']}
-        
-        Provide a structured summary including:
-        1. Best areas to stay
-        2. Must-see attractions with priorities
-        3. Optimal transportation strategy
-        4. Seasonal considerations
-        5. Budget allocation recommendations
-        6. Potential challenges or considerations
-        7. Daily activity suggestions
-        
-        Format as structured JSON.
-        """
+        prompt = _SYNTHESIS_PROMPT.format_map(data)
         
         try:
-            response = self.client.chat.completions.create(
-                model="gpt-4",
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.2
-            )
-            return {"synthesis": response.choices[0].message.content}
+            text = await self._cached_complete(MODEL_TIER['synthesis'], prompt, temperature=0.2)
+            return {"synthesis": text}
         except Exception as e:
-            logger.error(f"Synthesis error: {e}")
+            logger.error("Synthesis error: %s", e)
             return {"synthesis": "Synthesis unavailable"}
 
 # Planning Agent Implementation
 class PlanningAgent(BaseAgent):
+    # Research sections needed before the first itinerary draft can be written
+    ITINERARY_SECTIONS = ('attractions', 'accommodation')
+    
     def __init__(self, anthropic_api_key: str):
         super().__init__(AgentType.PLANNING, anthropic_api_key)
-        self.client = anthropic.Anthropic(api_key=anthropic_api_key)
+        import anthropic
+        self.retryable_errors = (anthropic.RateLimitError, anthropic.APIConnectionError, anthropic.InternalServerError)
+        # Current Anthropic SDKs are built on httpx2 and reject an httpx client,
+        # so this agent keeps the SDK's own keep-alive pool
+        self.client = anthropic.AsyncAnthropic(api_key=anthropic_api_key, max_retries=0)
+    
+    async def aclose(self) -> None:
+        """Close the Anthropic SDK's connection pool"""
+        await self.client.close()
+    
+    async def _stream(self, model: str, prompt: str, temperature: Optional[float], **options) -> AsyncIterator[str]:
+        async with self.client.messages.stream(
+            model=model,
+            temperature=temperature,
+            messages=[{"role": "user", "content": prompt}],
+            **options
+        ) as stream:
+            async for text in stream.text_stream:
+                yield text
         
     async def _process_internal(self, input_data: Dict) -> Dict:
-        research_data = input_data['research_data']
-        constraints = TravelConstraints(**input_data['constraints'])
+        constraints = input_data['constraints']
         destination = input_data['destination']
+        # Futures for research sections still in progress, when run as a pipeline
+        sections = input_data.get('research_sections')
+        drafted = None
+        
+        if sections is None:
+            research_data = input_data['research_data']
+        else:
+            # Draft the itinerary as soon as the sections it needs are in, unless
+            # the rest is already done or the draft input is too large to pass raw
+            partial = {name: await sections[name] for name in self.ITINERARY_SECTIONS}
+            if (all(future.done() for future in sections.values())
+                    or len(_prompt_json(partial)) > ResearchAgent.SYNTHESIS_CHAR_BUDGET):
+                research_data = (await input_data['research_output'])['research_data']
+            else:
+                research_data = drafted = partial
         
         # Generate optimized itinerary
         itinerary = await self._generate_itinerary(research_data, constraints, destination)
         
-        # Optimize logistics
-        optimized_itinerary = await self._optimize_logistics(itinerary, constraints)
+        # Optimize logistics, using the research the draft did not see once it
+        # is final, so a synthesized summary replaces the raw sections
+        context = None
+        if drafted is not None:
+            research_output = await input_data['research_output']
+            context = {
+                name: section for name, section in research_output['research_data'].items()
+                if name not in drafted
+            }
+        optimized_itinerary = await self._optimize_logistics(itinerary, constraints, context)
         
         # Calculate costs and metrics
         cost_analysis = await self._analyze_costs(optimized_itinerary, constraints)
@@ -374,126 +811,51 @@ class PlanningAgent(BaseAgent):
     async def _generate_itinerary(self, research_data: Dict, constraints: TravelConstraints, destination: str) -> Dict:
         """Generate base itinerary using Claude's reasoning capabilities"""
         
-        prompt = f"""
-        Create an optimized {constraints.duration_days}-day itinerary for {destination} based on this research data:
-        
-        {json.dumps(research_data, indent=2)}
-        
-        Constraints:
-        - Total budget: ${constraints.total_budget_usd}
-        - Travelers: {constraints.traveler_count}
-        - Style: {constraints.travel_style}
-        - Preferences: {', '.join(constraints.preferences)}
-        
-        Create a day-by-day itinerary that:
-        1. Optimizes travel time between locations
-        2. Groups activities by geographic proximity
-        3. Balances indoor/outdoor activities based on weather
-        4. Fits within budget constraints
-        5. Includes specific timing for activities
-        6. Suggests accommodation locations
-        7. Plans transportation between cities/regions
-        
-        Format as structured JSON with this schema:
-        {{
-            "itinerary": [
-                {{
-                    "day": 1,
-                    "date": "2024-XX-XX",
-                    "location": "City/Area Name",
-                    "activities": [
-                        {{
-                            "time": "09:00",
-                            "activity": "Activity Name",
-                            "duration": "2 hours",
-                            "cost": 25.00,
-                            "description": "Brief description",
-                            "location": "Specific location"
-                        }}
-                    ],
-                    "accommodation": "Hotel/Area recommendation",
-                    "transportation": "How to get around",
-                    "daily_budget": 150.00,
-                    "notes": "Special considerations"
-                }}
-            ]
-        }}
-        """
+        prompt = _ITINERARY_PROMPT.format(
+            destination=destination,
+            constraints=constraints,
+            research_data=_prompt_json(research_data),
+            preferences=', '.join(constraints.preferences)
+        )
         
         try:
-            message = self.client.messages.create(
-                model="claude-3-sonnet-20240229",
-                max_tokens=4000,
-                temperature=0.1,
-                messages=[{"role": "user", "content": prompt}]
+            text = await self._cached_complete(
+                MODEL_TIER['itinerary'], prompt, temperature=0.1, max_tokens=4000
             )
-            return {"itinerary": message.content[0].text}
+            return {"itinerary": text}
         except Exception as e:
-            logger.error(f"Itinerary generation error: {e}")
+            logger.error("Itinerary generation error: %s", e)
             return {"itinerary": "Itinerary generation failed"}
     
-    async def _optimize_logistics(self, itinerary: Dict, constraints: TravelConstraints) -> Dict:
+    async def _optimize_logistics(self, itinerary: Dict, constraints: TravelConstraints,
+                                  context: Optional[Dict] = None) -> Dict:
         """Optimize routing and timing"""
         
-        prompt = f"""
-        Optimize the logistics of this itinerary:
-        
-        {json.dumps(itinerary, indent=2)}
-        
-        Focus on:
-        1. Minimizing travel time between activities
-        2. Optimizing daily schedules (avoid rushing, allow buffer time)
-        3. Grouping activities by location
-        4. Considering opening hours and booking requirements
-        5. Planning meal times and breaks
-        6. Accounting for transportation delays
-        
-        Return the optimized itinerary with the same JSON structure but improved timing and logistics.
-        """
+        prompt = _LOGISTICS_PROMPT.format(itinerary=_prompt_json(itinerary))
+        if context:
+            prompt += _LOGISTICS_CONTEXT_PROMPT.format(context=_prompt_json(context))
         
         try:
-            message = self.client.messages.create(
-                model="claude-3-sonnet-20240229",
-                max_tokens=4000,
-                temperature=0.1,
-                messages=[{"role": "user", "content": prompt}]
+            text = await self._cached_complete(
+                MODEL_TIER['logistics'], prompt, temperature=0.1, max_tokens=4000
             )
-            return {"optimized_itinerary": message.content[0].text}
+            return {"optimized_itinerary": text}
         except Exception as e:
-            logger.error(f"Logistics optimization error: {e}")
+            logger.error("Logistics optimization error: %s", e)
             return {"optimized_itinerary": itinerary}
     
     async def _analyze_costs(self, itinerary: Dict, constraints: TravelConstraints) -> Dict:
         """Analyze and breakdown costs"""
         
-        prompt = f"""
-        Analyze the costs for this itinerary:
-        
-        {json.dumps(itinerary, indent=2)}
-        
-        Budget: ${constraints.total_budget_usd}
-        Travelers: {constraints.traveler_count}
-        
-        Provide detailed cost breakdown:
-        1. Daily costs by category (accommodation, food, activities, transport)
-        2. Total estimated cost
-        3. Budget vs actual comparison
-        4. Cost optimization suggestions if over budget
-        5. Buffer recommendations
-        
-        Format as JSON with specific cost figures.
-        """
+        prompt = _COSTS_PROMPT.format(itinerary=_prompt_json(itinerary), constraints=constraints)
         
         try:
-            message = self.client.messages.create(
-                model="claude-3-sonnet-20240229",
-                max_tokens=2000,
-                temperature=0.1,
-                messages=[{"role": "user", "content": prompt}]
+            text = await self._cached_complete(
+                MODEL_TIER['costs'], prompt, temperature=0.1, max_tokens=2000
             )
-            return {"cost_analysis": message.content[0].text}
+            return {"cost_analysis": text}
         except Exception as e:
-            logger.error(f"Cost analysis error: {e}")
+            logger.error("Cost analysis error: %s", e)
             return {"cost_analysis": "Cost analysis unavailable"}
     
     def _calculate_metrics(self, itinerary: Dict, constraints: TravelConstraints) -> Dict:
@@ -509,12 +871,30 @@ class PlanningAgent(BaseAgent):
 class PersonalizationAgent(BaseAgent):
     def __init__(self, google_api_key: str):
         super().__init__(AgentType.PERSONALIZATION, google_api_key)
+        import google.generativeai as genai
+        from google.api_core import exceptions as google_exceptions
+        self.retryable_errors = (
+            google_exceptions.ResourceExhausted,
+            google_exceptions.ServiceUnavailable,
+            google_exceptions.InternalServerError,
+            google_exceptions.DeadlineExceeded
+        )
+        # The Gemini SDK talks gRPC and manages its own channel, so it does
+        # not take part in the shared httpx pool
         genai.configure(api_key=google_api_key)
-        self.model = genai.GenerativeModel('gemini-pro')
+        self.model_name = 'gemini-pro'
+        self.model = genai.GenerativeModel(self.model_name)
+    
+    async def _stream(self, model: str, prompt: str, temperature: Optional[float], **options) -> AsyncIterator[str]:
+        if temperature is not None:
+            options['generation_config'] = {'temperature': temperature}
+        response = await self.model.generate_content_async(prompt, stream=True, **options)
+        async for chunk in response:
+            yield chunk.text
         
     async def _process_internal(self, input_data: Dict) -> Dict:
         itinerary = input_data['itinerary']
-        constraints = TravelConstraints(**input_data['constraints'])
+        constraints = input_data['constraints']
         research_data = input_data.get('research_data', {})
         
         # Personalize based on preferences
@@ -532,67 +912,32 @@ class PersonalizationAgent(BaseAgent):
     async def _personalize_itinerary(self, itinerary: Dict, constraints: TravelConstraints, research_data: Dict) -> Dict:
         """Personalize itinerary based on user preferences"""
         
-        prompt = f"""
-        Personalize this travel itinerary based on user preferences:
-        
-        ITINERARY:
-        {json.dumps(itinerary, indent=2)}
-        
-        USER PROFILE:
-        - Preferences: {', '.join(constraints.preferences)}
-        - Travel style: {constraints.travel_style}
-        - Group size: {constraints.traveler_count}
-        - Must visit: {constraints.must_visit or 'None specified'}
-        - Avoid: {constraints.avoid or 'None specified'}
-        
-        RESEARCH CONTEXT:
-        {json.dumps(research_data, indent=2)}
-        
-        Personalize by:
-        1. Replacing generic recommendations with specific ones matching preferences
-        2. Adjusting activity types and intensity based on travel style
-        3. Adding local experiences that match interests
-        4. Suggesting restaurants and food experiences
-        5. Including shopping or cultural activities if relevant
-        6. Adding photography spots if interested in photography
-        7. Suggesting local interactions or cultural immersion opportunities
-        
-        Keep the same JSON structure but enhance with personalized details.
-        """
+        prompt = _PERSONALIZATION_PROMPT.format(
+            itinerary=_prompt_json(itinerary),
+            constraints=constraints,
+            preferences=', '.join(constraints.preferences),
+            must_visit=constraints.must_visit or 'None specified',
+            avoid=constraints.avoid or 'None specified',
+            research_data=_prompt_json(research_data)
+        )
         
         try:
-            response = self.model.generate_content(prompt)
-            return {"personalized": response.text}
+            text = await self._cached_complete(self.model_name, prompt)
+            return {"personalized": text}
         except Exception as e:
-            logger.error(f"Personalization error: {e}")
+            logger.error("Personalization error: %s", e)
             return {"personalized": itinerary}
     
     async def _add_contextual_recommendations(self, itinerary: Dict, constraints: TravelConstraints) -> Dict:
         """Add contextual tips and recommendations"""
         
-        prompt = f"""
-        Enhance this personalized itinerary with contextual recommendations:
-        
-        {json.dumps(itinerary, indent=2)}
-        
-        Add:
-        1. Local etiquette and cultural tips
-        2. Language phrases that might be helpful
-        3. Tipping customs and payment methods
-        4. Safety considerations
-        5. Packing suggestions specific to activities
-        6. Alternative options for bad weather
-        7. Local apps or services to download
-        8. Emergency contacts and important information
-        
-        Format as enhanced JSON with additional context fields.
-        """
+        prompt = _RECOMMENDATIONS_PROMPT.format(itinerary=_prompt_json(itinerary))
         
         try:
-            response = self.model.generate_content(prompt)
-            return {"enhanced_itinerary": response.text}
+            text = await self._cached_complete(self.model_name, prompt)
+            return {"enhanced_itinerary": text}
         except Exception as e:
-            logger.error(f"Contextual enhancement error: {e}")
+            logger.error("Contextual enhancement error: %s", e)
             return {"enhanced_itinerary": itinerary}
     
     def _generate_notes(self, constraints: TravelConstraints) -> List[str]:
@@ -607,47 +952,78 @@ class PersonalizationAgent(BaseAgent):
 # Main Orchestrator
 class TravelPlanningOrchestrator:
     def __init__(self, openai_key: str, anthropic_key: str, google_key: str, serp_key: str = None):
-        self.research_agent = ResearchAgent(openai_key, serp_key)
+        # One keep-alive connection pool shared by the OpenAI and SerpAPI requests
+        self.http_client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+            http2=True
+        )
+        self.research_agent = ResearchAgent(openai_key, serp_key, http_client=self.http_client)
         self.planning_agent = PlanningAgent(anthropic_key)
         self.personalization_agent = PersonalizationAgent(google_key)
+
+    async def __aenter__(self) -> "TravelPlanningOrchestrator":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.aclose()
+
+    async def aclose(self) -> None:
+        """Close the shared HTTP connection pool and the planning agent's own pool"""
+        await self.planning_agent.aclose()
+        await self.http_client.aclose()
         
     async def plan_trip(self, destination: str, constraints: TravelConstraints) -> CompleteItinerary:
         """Main orchestration method"""
-        logger.info(f"Starting trip planning for {destination}")
+        logger.info("Starting trip planning for %s", destination)
+        start_time = time.perf_counter()
+        
+        # Research publishes each section as soon as it is known, so planning
+        # can start drafting while the rest of the research is still running
+        loop = asyncio.get_running_loop()
+        sections = {name: loop.create_future() for name in ResearchAgent.SECTIONS}
         
         # Phase 1: Research
         logger.info("Phase 1: Research Agent processing...")
         research_input = {
             'destination': destination,
-            'constraints': asdict(constraints)
+            'constraints': constraints,
+            'sections': sections
         }
-        research_output = await self.research_agent.process(research_input)
+        research_task = asyncio.create_task(self.research_agent.process(research_input))
+        # Never leave planning waiting on sections research did not deliver
+        research_task.add_done_callback(lambda _: [future.cancel() for future in sections.values()])
         
-        # Phase 2: Planning
+        # Phase 2: Planning, pipelined with research
         logger.info("Phase 2: Planning Agent processing...")
         planning_input = {
             'destination': destination,
-            'constraints': asdict(constraints),
-            'research_data': research_output['research_data']
+            'constraints': constraints,
+            'research_sections': sections,
+            'research_output': research_task
         }
-        planning_output = await self.planning_agent.process(planning_input)
+        planning_task = asyncio.create_task(self.planning_agent.process(planning_input))
+        
+        try:
+            research_output, planning_output = await asyncio.gather(research_task, planning_task)
+        except BaseException:
+            research_task.cancel()
+            planning_task.cancel()
+            raise
         
         # Phase 3: Personalization
         logger.info("Phase 3: Personalization Agent processing...")
         personalization_input = {
             'destination': destination,
-            'constraints': asdict(constraints),
+            'constraints': constraints,
             'research_data': research_output['research_data'],
             'itinerary': planning_output['itinerary']
         }
         personalization_output = await self.personalization_agent.process(personalization_input)
         
-        # Compile final result
-        total_time = (self.research_agent.processing_time + 
-                     self.planning_agent.processing_time + 
-                     self.personalization_agent.processing_time)
+        # Compile final result; research and planning overlap, so report wall-clock time
+        total_time = time.perf_counter() - start_time
         
-        logger.info(f"Trip planning completed in {total_time:.2f} seconds")
+        logger.info("Trip planning completed in %.2f seconds", total_time)
         
         return {
             'destination': destination,
@@ -664,6 +1040,11 @@ class TravelPlanningOrchestrator:
         }
 
 # CLI Interface
+def _save_result(path: str, result: Dict) -> None:
+    """Write the trip result to disk as indented JSON"""
+    with open(path, 'wb') as f:
+        f.write(orjson.dumps(result, default=str, option=orjson.OPT_INDENT_2))
+
 def main():
     """Command line interface for the travel planner"""
     import argparse
@@ -683,6 +1064,7 @@ def main():
     openai_key = os.getenv('OPENAI_API_KEY')
     anthropic_key = os.getenv('ANTHROPIC_API_KEY')
     google_key = os.getenv('GOOGLE_API_KEY')
+    serp_key = os.getenv('SERP_API_KEY')
     
     if not all([openai_key, anthropic_key, google_key]):
         print("Error: Missing API keys. Please set OPENAI_API_KEY, ANTHROPIC_API_KEY, and GOOGLE_API_KEY environment variables.")
@@ -698,14 +1080,14 @@ def main():
     )
     
     # Run the planner
-    orchestrator = TravelPlanningOrchestrator(openai_key, anthropic_key, google_key)
+    orchestrator = TravelPlanningOrchestrator(openai_key, anthropic_key, google_key, serp_key)
     
     async def run_planning():
-        result = await orchestrator.plan_trip(args.destination, constraints)
+        async with orchestrator:
+            result = await orchestrator.plan_trip(args.destination, constraints)
         
-        # Save result
-        with open(args.output, 'w') as f:
-            json.dump(result, f, indent=2, default=str)
+        # Save result off the event loop
+        await asyncio.to_thread(_save_result, args.output, result)
         
         print(f"Trip planning completed!")
         print(f"Total time: {result['total_processing_time']:.2f} seconds")
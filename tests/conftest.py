@@ -0,0 +1,31 @@
+# conftest.py
+import asyncio
+import os
+import sys
+import pytest
+
+# The planner lives in src/ and is not installed as a package
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from travel_planner_system import TravelConstraints
+
+# asyncio.run in the tests picks up uvloop where it is available
+if sys.platform != "win32":
+    try:
+        import uvloop
+    except ImportError:
+        pass
+    else:
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+
+
+@pytest.fixture(scope="session")
+def sample_constraints():
+    """Constraints are frozen, so one instance can serve every test"""
+    return TravelConstraints(
+        total_budget_usd=1500,
+        duration_days=7,
+        traveler_count=2,
+        preferences=("culture", "food"),
+        travel_style="balanced"
+    )
@@ -1,9 +1,17 @@
 # test_travel_planner.py
 import pytest
 import asyncio
-import json
-from unittest.mock import Mock, patch
-from travel_planner import (
+import functools
+import logging
+import pkgutil
+import sys
+from unittest.mock import AsyncMock, patch
+import anthropic
+import httpx
+import openai
+import orjson
+from travel_planner_system import (
+    MODEL_TIER,
     TravelPlanningOrchestrator, 
     TravelConstraints,
     ResearchAgent,
@@ -11,59 +19,316 @@ from travel_planner import (
     PersonalizationAgent
 )
 
+# Agent payloads shared by every mocked run
+_RESEARCH = {'research_data': 'test'}
+_PLAN = {'itinerary': 'test'}
+_PERS = {'personalized_itinerary': 'test'}
+_PAYLOADS = {'research': _RESEARCH, 'planning': _PLAN, 'personalization': _PERS}
+
+# plan_trip hands destinations back unchanged, so results can be checked by identity
+_DESTINATIONS = tuple(sys.intern(name) for name in ("Georgia", "Japan", "Peru"))
+
+# Simulated agent latency for the concurrency test
+_AGENT_DELAY = 0.1
+
 class TestTravelPlanner:
     
-    @pytest.fixture
-    def sample_constraints(self):
-        return TravelConstraints(
-            total_budget_usd=1500,
-            duration_days=7,
-            traveler_count=2,
-            preferences=["culture", "food"],
-            travel_style="balanced"
-        )
-    
-    @pytest.fixture
+    @pytest.fixture(scope="module")
     def mock_orchestrator(self):
-        return TravelPlanningOrchestrator(
+        orchestrator = TravelPlanningOrchestrator(
             openai_key="test-key",
             anthropic_key="test-key",
             google_key="test-key"
         )
+        yield orchestrator
+        asyncio.run(orchestrator.aclose())
+    
+    @pytest.fixture(scope="module")
+    def patched_orchestrator(self, mock_orchestrator):
+        # One mock answers for every agent, routed by agent type
+        dispatcher = AsyncMock(side_effect=lambda agent, *args, **kwargs: _PAYLOADS[agent.agent_type.value])
+        with pytest.MonkeyPatch.context() as mp:
+            for agent in (mock_orchestrator.research_agent,
+                          mock_orchestrator.planning_agent,
+                          mock_orchestrator.personalization_agent):
+                mp.setattr(agent, 'process', functools.partial(dispatcher, agent))
+            yield mock_orchestrator
     
     def test_constraints_creation(self, sample_constraints):
         assert sample_constraints.total_budget_usd == 1500
         assert sample_constraints.duration_days == 7
         assert "culture" in sample_constraints.preferences
+        # Ordered for prompts, and hashable because the constraints are frozen
+        assert sample_constraints.preferences == ("culture", "food")
+        assert hash(sample_constraints) == hash(TravelConstraints(1500, 7, 2, ["culture", "food"]))
+    
+    @pytest.mark.parametrize("agent_cls,sdk_target,expected", [
+        (ResearchAgent, 'openai.AsyncOpenAI', "research"),
+        (PlanningAgent, 'anthropic.AsyncAnthropic', "planning"),
+        (PersonalizationAgent, 'google.generativeai.configure', "personalization"),
+    ])
+    def test_agent_initialization(self, agent_cls, sdk_target, expected):
+        # Wrap the real SDK entry point so the agent still gets a working client
+        api_key = f"{expected}-test-key"
+        with patch(sdk_target, wraps=pkgutil.resolve_name(sdk_target)) as sdk_mock:
+            agent = agent_cls(api_key)
+        assert agent.agent_type.value == expected
+        assert agent.api_key == api_key
+        sdk_mock.assert_called_once()
+        assert sdk_mock.call_args.kwargs['api_key'] == api_key
+        asyncio.run(agent.aclose())
+    
+    def test_orchestrator_builds_real_clients(self, mock_orchestrator):
+        # Building a provider client makes no network calls, so the real SDKs are
+        # used here and reject an HTTP client they cannot drive
+        assert isinstance(mock_orchestrator.research_agent.client, openai.AsyncOpenAI)
+        assert isinstance(mock_orchestrator.planning_agent.client, anthropic.AsyncAnthropic)
+        assert mock_orchestrator.research_agent.client._client is mock_orchestrator.http_client
+    
+    @pytest.mark.parametrize("destination", _DESTINATIONS)
+    def test_orchestrator_flow(self, patched_orchestrator, sample_constraints, destination):
+        result = asyncio.run(patched_orchestrator.plan_trip(destination, sample_constraints))
+        
+        assert result['destination'] is destination
+        assert 'total_processing_time' in result
+        assert 'agent_times' in result
+    
+    def test_research_and_planning_overlap(self, mock_orchestrator, sample_constraints):
+        events = []
+        with patch.object(mock_orchestrator.research_agent, 'process', new=self._delayed(events, 'research', _RESEARCH)), \
+             patch.object(mock_orchestrator.planning_agent, 'process', new=self._delayed(events, 'planning', _PLAN)), \
+             patch.object(mock_orchestrator.personalization_agent, 'process', new=self._delayed(events, 'personalization', _PERS)):
+            asyncio.run(mock_orchestrator.plan_trip("Georgia", sample_constraints))
+        
+        # Research and planning overlap, personalization follows both; the order
+        # is deterministic, so no wall-clock bound is needed
+        assert events[:2] == ['research:start', 'planning:start']
+        assert events.index('personalization:start') > events.index('research:end')
+        assert events.index('personalization:start') > events.index('planning:end')
+    
+    @pytest.fixture
+    def pipeline_orchestrator(self):
+        # Fresh agents with real process methods; the SerpAPI key keeps events
+        # out of the combined research call
+        orchestrator = TravelPlanningOrchestrator(
+            openai_key="test-key",
+            anthropic_key="test-key",
+            google_key="test-key",
+            serp_key="serp-test-key"
+        )
+        yield orchestrator
+        asyncio.run(orchestrator.aclose())
+    
+    def test_itinerary_draft_starts_before_slow_research(self, pipeline_orchestrator, sample_constraints):
+        events = []
+        
+        async def research_stream(model, prompt, temperature, **options):
+            if 'response_format' in options:
+                # The combined call answers at once
+                yield orjson.dumps({name: name for name in ResearchAgent.SECTIONS}).decode()
+            else:
+                # With a SerpAPI key, events are the one lookup left outside the combined call
+                events.append('events:start')
+                await asyncio.sleep(_AGENT_DELAY)
+                events.append('events:end')
+                yield 'events'
+        
+        async def planning_stream(model, prompt, temperature, **options):
+            events.append(f"{model}:start")
+            yield 'plan'
+        
+        async def personalization_stream(model, prompt, temperature, **options):
+            yield 'personalized'
+        
+        with patch.object(pipeline_orchestrator.research_agent, '_search_events', new=AsyncMock(return_value=[])), \
+             patch.object(pipeline_orchestrator.research_agent, '_stream', new=research_stream), \
+             patch.object(pipeline_orchestrator.planning_agent, '_stream', new=planning_stream), \
+             patch.object(pipeline_orchestrator.personalization_agent, '_stream', new=personalization_stream):
+            result = asyncio.run(pipeline_orchestrator.plan_trip("Georgia", sample_constraints))
+        
+        # The draft only needs the combined sections; logistics waits for the rest
+        assert events.index(f"{MODEL_TIER['itinerary']}:start") < events.index('events:end')
+        assert events.index(f"{MODEL_TIER['logistics']}:start") > events.index('events:end')
+        assert result['research_output']['research_data']['events'] == {'events': 'events'}
+    
+    def test_unpublished_sections_do_not_strand_planning(self, pipeline_orchestrator, sample_constraints):
+        # Research ends without publishing any section, so its done-callback must
+        # cancel the futures planning is waiting on rather than leave it hanging
+        with patch.object(pipeline_orchestrator.research_agent, 'process', new=AsyncMock(return_value=_RESEARCH)):
+            with pytest.raises(asyncio.CancelledError):
+                asyncio.run(asyncio.wait_for(pipeline_orchestrator.plan_trip("Georgia", sample_constraints), timeout=5))
+    
+    @staticmethod
+    def _delayed(events, name, payload):
+        async def side_effect(*args, **kwargs):
+            events.append(f"{name}:start")
+            await asyncio.sleep(_AGENT_DELAY)
+            events.append(f"{name}:end")
+            return payload
+        return AsyncMock(side_effect=side_effect)
+
+
+class TestResearchAgent:
     
-    @patch('openai.OpenAI')
-    def test_research_agent_initialization(self, mock_openai):
+    @pytest.fixture
+    def research_agent(self):
         agent = ResearchAgent("test-key")
-        assert agent.agent_type.value == "research"
-        assert agent.api_key == "test-key"
-    
-    @patch('anthropic.Anthropic')
-    def test_planning_agent_initialization(self, mock_anthropic):
-        agent = PlanningAgent("test-key")
-        assert agent.agent_type.value == "planning"
-    
-    @patch('google.generativeai.configure')
-    def test_personalization_agent_initialization(self, mock_genai):
-        agent = PersonalizationAgent("test-key")
-        assert agent.agent_type.value == "personalization"
-    
-    @pytest.mark.asyncio
-    async def test_orchestrator_flow(self, mock_orchestrator, sample_constraints):
-        # Mock the agent responses
-        with patch.object(mock_orchestrator.research_agent, 'process', return_value={'research_data': 'test'}), \
-             patch.object(mock_orchestrator.planning_agent, 'process', return_value={'itinerary': 'test'}), \
-             patch.object(mock_orchestrator.personalization_agent, 'process', return_value={'personalized_itinerary': 'test'}):
+        yield agent
+        asyncio.run(agent.aclose())
+    
+    @staticmethod
+    def _fake_stream(combined_reply, calls):
+        """Provider stream answering the combined JSON-mode call with combined_reply and any lookup with its model"""
+        async def stream(model, prompt, temperature, **options):
+            calls.append('combined' if 'response_format' in options else model)
+            yield combined_reply if 'response_format' in options else f"{model} reply"
+        return stream
+    
+    def _research(self, agent, sample_constraints):
+        output = asyncio.run(agent.process({'destination': "Georgia", 'constraints': sample_constraints}))
+        return output['raw_data']
+    
+    def test_combined_research(self, research_agent, sample_constraints):
+        calls = []
+        reply = orjson.dumps({name: f"{name} research" for name in ResearchAgent.SECTIONS}).decode()
+        with patch.object(research_agent, '_stream', new=self._fake_stream(reply, calls)):
+            raw_data = self._research(research_agent, sample_constraints)
+        
+        assert calls == ['combined']
+        assert raw_data == {
+            name: {key: f"{name} research"} for name, key in ResearchAgent.SECTIONS.items()
+        }
+    
+    @pytest.mark.parametrize("reply", [
+        "not json",
+        '{"weather": "sunny", "events": ',
+        '{"weather": "sunny"}',
+    ], ids=["invalid", "truncated", "missing-key"])
+    def test_combined_research_falls_back_to_lookups(self, research_agent, sample_constraints, reply):
+        calls = []
+        with patch.object(research_agent, '_stream', new=self._fake_stream(reply, calls)):
+            raw_data = self._research(research_agent, sample_constraints)
+        
+        assert calls[0] == 'combined'
+        assert sorted(calls[1:]) == sorted(MODEL_TIER[name] for name in ResearchAgent.SECTIONS)
+        assert raw_data == {
+            name: {key: f"{MODEL_TIER[name]} reply"} for name, key in ResearchAgent.SECTIONS.items()
+        }
+    
+    def test_failed_lookup_degrades_only_its_section(self, research_agent, sample_constraints):
+        calls = []
+        with patch.object(research_agent, '_stream', new=self._fake_stream("not json", calls)), \
+             patch.object(research_agent, '_get_attractions', new=AsyncMock(side_effect=RuntimeError("boom"))):
+            raw_data = self._research(research_agent, sample_constraints)
+        
+        assert raw_data['attractions'] == {'attractions': "Attractions information unavailable"}
+        for name, key in ResearchAgent.SECTIONS.items():
+            if name != 'attractions':
+                assert raw_data[name] == {key: f"{MODEL_TIER[name]} reply"}
+    
+    @pytest.fixture
+    def serp_agent(self):
+        """Build a ResearchAgent whose SerpAPI requests go to a mock transport"""
+        http_clients = []
+        
+        def build(serp_key, status=200, events=()):
+            requests = []
             
-            result = await mock_orchestrator.plan_trip("Georgia", sample_constraints)
+            def handler(request):
+                requests.append(request)
+                return httpx.Response(status, json={'events_results': list(events)})
             
-            assert result['destination'] == "Georgia"
-            assert 'total_processing_time' in result
-            assert 'agent_times' in result
+            http_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+            http_clients.append(http_client)
+            return ResearchAgent("test-key", serp_key, http_client=http_client), requests
+        
+        yield build
+        for http_client in http_clients:
+            asyncio.run(http_client.aclose())
+    
+    def _research_prompts(self, agent, sample_constraints):
+        prompts = []
+        
+        async def stream(model, prompt, temperature, **options):
+            prompts.append(prompt)
+            yield orjson.dumps({name: name for name in ResearchAgent.SECTIONS}).decode() if 'response_format' in options else "reply"
+        
+        with patch.object(agent, '_stream', new=stream):
+            self._research(agent, sample_constraints)
+        return prompts
+    
+    def test_event_listings_reach_events_prompt(self, serp_agent, sample_constraints):
+        listing = {'title': "Tbilisoba", 'date': {'when': "Sat, Oct 5"}, 'address': ["Old Town", "Tbilisi"]}
+        agent, serp_requests = serp_agent("serp-secret", events=[listing])
+        prompts = self._research_prompts(agent, sample_constraints)
+        
+        assert len(serp_requests) == 1
+        assert serp_requests[0].url.params['q'] == "Events in Georgia"
+        listed = orjson.dumps([{'title': "Tbilisoba", 'when': "Sat, Oct 5", 'address': "Old Town, Tbilisi"}]).decode()
+        # Events are looked up on their own once listings arrive; the combined call leaves them out
+        assert [prompt for prompt in prompts if listed in prompt] == [prompts[-1]]
+        assert '"events"' not in prompts[0]
+    
+    def test_serp_error_does_not_log_key(self, serp_agent, sample_constraints, caplog):
+        agent, serp_requests = serp_agent("serp-secret", status=403)
+        with caplog.at_level(logging.ERROR):
+            self._research_prompts(agent, sample_constraints)
+        
+        assert len(serp_requests) == 1
+        assert "SerpAPI events error: HTTP 403" in caplog.messages
+        assert "serp-secret" not in caplog.text
+    
+    def test_no_serp_request_without_key(self, serp_agent, sample_constraints):
+        agent, serp_requests = serp_agent(None)
+        prompts = self._research_prompts(agent, sample_constraints)
+        
+        assert serp_requests == []
+        assert len(prompts) == 1
+
+
+class TestBaseAgent:
+    
+    @pytest.fixture
+    def agent(self):
+        # Any concrete agent exercises the shared BaseAgent cache and retry logic
+        agent = ResearchAgent("test-key")
+        yield agent
+        asyncio.run(agent.aclose())
+    
+    def _complete_all(self, agent, prompts):
+        async def run():
+            return [await agent._cached_complete("model", prompt) for prompt in prompts]
+        return asyncio.run(run())
+    
+    def test_cache_hit_skips_provider(self, agent):
+        with patch.object(agent, '_complete', new=AsyncMock(return_value="reply")) as complete:
+            assert self._complete_all(agent, ["prompt", "prompt"]) == ["reply", "reply"]
+        complete.assert_awaited_once()
+    
+    def test_cache_evicts_least_recently_used(self, agent):
+        with patch.object(agent, 'CACHE_SIZE', 2), \
+             patch.object(agent, '_complete', new=AsyncMock(side_effect=lambda model, prompt, temperature: prompt)) as complete:
+            # "a" is used again before "c" arrives, so "b" is the one evicted
+            self._complete_all(agent, ["a", "b", "a", "c"])
+            assert complete.await_count == 3
+            self._complete_all(agent, ["a", "c"])
+            assert complete.await_count == 3
+            self._complete_all(agent, ["b"])
+            assert complete.await_count == 4
+    
+    def test_retryable_error_is_retried(self, agent):
+        with patch.object(agent, 'retryable_errors', (ConnectionError,)), \
+             patch.object(agent, '_complete', new=AsyncMock(side_effect=[ConnectionError(), "reply"])) as complete, \
+             patch('asyncio.sleep', new=AsyncMock()):
+            assert self._complete_all(agent, ["prompt"]) == ["reply"]
+        assert complete.await_count == 2
+    
+    def test_non_retryable_error_propagates(self, agent):
+        with patch.object(agent, 'retryable_errors', (ConnectionError,)), \
+             patch.object(agent, '_complete', new=AsyncMock(side_effect=ValueError("bad request"))) as complete:
+            with pytest.raises(ValueError, match="bad request"):
+                self._complete_all(agent, ["prompt"])
+        complete.assert_awaited_once()
 
 if __name__ == "__main__":  
     pytest.main([__file__])